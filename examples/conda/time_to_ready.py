@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+'''Measure the time from starting a Jupyter Lab image to the first successful
+HTTP response of the server.
+
+The image is run using `apptainer run`, so its runscript should start Jupyter
+Lab and pass on its arguments, as `jupyterlab.recipe` does.
+
+Usage:
+    $ ./time_to_ready.py  jupyterlab.sif
+    $ ./time_to_ready.py  --runs 5  --timeout 300  jupyterlab.sif
+'''
+
+import argparse
+import os
+import secrets
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+
+def find_free_port():
+    '''Return a TCP port on the local host that is currently not in use'''
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def is_ready(url):
+    '''Check whether the server responds successfully to a request'''
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status == 200
+    except (urllib.error.URLError, ConnectionError, OSError):
+        return False
+
+
+def stop(process):
+    '''Stop the process and everything it started, apptainer starts several
+    processes, so the whole session is stopped; it may have exited already'''
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        pass
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        process.wait()
+
+
+def time_to_ready(image, apptainer, timeout, interval):
+    '''Start the image, and return the number of seconds until the server
+    responds, or None when it doesn't within the timeout'''
+    port = find_free_port()
+    token = secrets.token_hex(16)
+    command = [apptainer, 'run', image, '--no-browser', '--ip=127.0.0.1',
+               f'--port={port}', f'--ServerApp.token={token}']
+    url = f'http://127.0.0.1:{port}/api/status?token={token}'
+    start = time.perf_counter()
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL,
+                               start_new_session=True)
+    try:
+        while time.perf_counter() - start < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f'Jupyter Lab exited with code {process.returncode}.')
+            if is_ready(url):
+                return time.perf_counter() - start
+            time.sleep(interval)
+        return None
+    finally:
+        stop(process)
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='measure the time to a '
+                                                     'ready Jupyter Lab server')
+    arg_parser.add_argument('image', help='Jupyter Lab image to run')
+    arg_parser.add_argument('--runs', type=int, default=1,
+                            help='number of times to start the image')
+    arg_parser.add_argument('--timeout', type=float, default=600.0,
+                            help='maximum number of seconds to wait')
+    arg_parser.add_argument('--interval', type=float, default=0.1,
+                            help='number of seconds between requests')
+    arg_parser.add_argument('--apptainer', default='apptainer',
+                            help='apptainer or singularity executable')
+    options = arg_parser.parse_args()
+    for run in range(1, options.runs + 1):
+        seconds = time_to_ready(options.image, options.apptainer,
+                                options.timeout, options.interval)
+        if seconds is None:
+            print(f'run {run}: not ready after {options.timeout:.1f} s')
+            sys.exit(1)
+        print(f'run {run}: ready after {seconds:.3f} s')
@@ -0,0 +1,478 @@
+#!/usr/bin/env python
+'''Attribute the size of an image to the building blocks of the hpccm recipe
+it was built from, and flag files that are likely not needed at runtime:
+leftover installers and temporary files, package caches, documentation and
+static libraries.
+
+Each file in the image is attributed to a line of the recipe.  Files that
+belong to a Debian package are attributed to the first building block that
+installs the package, either explicitly or as a dependency.  Other files are
+attributed to the building block that claims the longest prefix of their
+path: the destination of a copy, the installation prefix of a building block,
+the library directories of R and pip for commands that install packages, or
+a specific path the building block mentions.  Standard directories such as
+`/usr/local` or `/usr/local/lib` are never claimed as a whole, building
+blocks that install there, such as `cmake`, claim the files they are known to
+install instead.  Files that are not claimed by any building block are attributed to the base image.
+Without `--base-image`, the packages of the base image that are dependencies
+of packages installed by the recipe are attributed to the recipe as well.
+
+The savings are estimated from the size of the flagged files, scaled by the
+compression ratio of the SIF file, and the bandwidths to transfer an image to
+a node and to stage it to node-local storage.
+
+Usage:
+    $ ./analyze_image.py  --recipe oneapi/oneapi_hpc.py  --image oneapi_hpc.sif
+    $ ./analyze_image.py  --recipe r_container/r_container.py  \
+          --userarg apt_list=apt_packages.txt  \
+                    r_package_install=install_packages.R  \
+          --image r_container.sif  --base-image docker://ubuntu:22.04
+
+The image can be a SIF file or a sandbox directory.  A SIF file, or a base
+image such as `docker://ubuntu:22.04`, is converted into a temporary sandbox
+directory using `apptainer build --sandbox`, so apptainer should be available
+and `TMPDIR` should have room for the unpacked image.  Unlike listing the files
+with `apptainer exec`, this includes the image's own `/tmp` and `/var/tmp`.
+'''
+
+import argparse
+import collections
+import contextlib
+import linecache
+import os
+import posixpath
+import re
+import subprocess
+import sys
+import tempfile
+
+import hpccm
+
+from render_recipe import parse_userargs
+
+
+Layer = collections.namedtuple('Layer', ['lineno', 'name', 'text', 'prefixes',
+                                         'installs'])
+
+# attribution of files that are in the base image
+BASE_IMAGE = 'base image'
+
+# paths that building blocks mention, but that are too generic to attribute
+# the files below them to that building block
+GENERIC_PATHS = {
+    '/', '/bin', '/bin/bash', '/bin/sh', '/dev', '/dev/null', '/etc', '/home', '/lib', '/lib64',
+    '/mnt', '/opt', '/proc', '/root', '/run', '/sbin', '/srv', '/sys', '/tmp',
+    '/usr', '/usr/bin', '/usr/include', '/usr/lib', '/usr/lib64',
+    '/usr/libexec', '/usr/sbin', '/usr/share', '/usr/src',
+    '/usr/lib/x86_64-linux-gnu', '/usr/lib/aarch64-linux-gnu',
+    '/usr/lib/python3/dist-packages', '/usr/share/doc', '/usr/share/man',
+    '/usr/local', '/usr/local/bin', '/usr/local/etc', '/usr/local/include',
+    '/usr/local/lib', '/usr/local/lib64', '/usr/local/man', '/usr/local/sbin',
+    '/usr/local/share', '/usr/local/src',
+    '/var', '/var/cache', '/var/cache/apt', '/var/lib', '/var/lib/apt/lists',
+    '/var/log', '/var/tmp',
+    '/etc/apt', '/etc/apt/sources.list.d', '/etc/ld.so.conf.d', '/etc/profile.d',
+}
+
+# commands that install packages in a shell layer, and the directories they
+# install them in
+INSTALL_COMMANDS = [
+    (re.compile(r'\bRscript\b|\bR\s+CMD\s+INSTALL\b|install\.packages'),
+     re.compile(r'/usr/(local/)?lib/R/(site-)?library/')),
+    (re.compile(r'\bpip3?\s+install\b|\bpython3?\s+-m\s+pip\s+install\b'),
+     re.compile(r'/usr/(local/)?lib/python3[\d.]*/(site|dist)-packages/')),
+]
+
+PATH_PATTERN = re.compile(r'(?<![\w.:/$-])(/[\w.+@-]+(?:/[\w.+@-]+)*)')
+APT_INSTALL_PATTERN = re.compile(r'apt-get\s+install\s+([^&;|\n]*)')
+
+INSTALLER_SUFFIXES = ('.sh', '.run', '.bin', '.deb', '.rpm', '.tar', '.tar.gz',
+                      '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.zip')
+# installers are only flagged in these directories, or when the recipe copied
+# them into the image, elsewhere such files may well be needed at runtime
+INSTALLER_DIRS = {'/', '/tmp', '/var/tmp', '/root', '/setup', '/opt'}
+CACHE_PREFIXES = ('/var/cache/', '/var/lib/apt/lists/', '/root/.cache/',
+                  '/root/.npm/', '/root/.conda/pkgs/')
+DOC_PREFIXES = ('/usr/share/doc/', '/usr/share/man/', '/usr/share/info/',
+                '/usr/share/gtk-doc/', '/usr/share/help/')
+DOC_COMPONENTS = {'doc', 'docs', 'documentation', 'man'}
+
+
+def load_layers(recipe_file, userargs):
+    '''Execute the recipe and return the layers of the stage the image is
+    built from, i.e., the last stage, together with their recipe line'''
+    recipe_path = os.path.abspath(recipe_file)
+    recorded = []
+    original_iadd = hpccm.Stage.__iadd__
+    original_baseimage = hpccm.Stage.baseimage
+
+    def recipe_lineno():
+        # find the line in the recipe that adds the layer
+        frame = sys._getframe(2)
+        while frame is not None:
+            if os.path.abspath(frame.f_code.co_filename) == recipe_path:
+                return frame.f_lineno
+            frame = frame.f_back
+        return None
+
+    def recording_iadd(stage, layer):
+        lineno = recipe_lineno()
+        for item in layer if isinstance(layer, list) else [layer]:
+            recorded.append((stage, item, lineno))
+        return original_iadd(stage, layer)
+
+    def recording_baseimage(stage, image, _distro=''):
+        # Stage.baseimage inserts the layer without using +=
+        if image:
+            layer = hpccm.primitives.baseimage(image=image, _distro=_distro)
+            recorded.append((stage, layer, recipe_lineno()))
+        return original_baseimage(stage, image, _distro=_distro)
+
+    hpccm.Stage.__iadd__ = recording_iadd
+    hpccm.Stage.baseimage = recording_baseimage
+    try:
+        hpccm.recipe(recipe_file, ctype=hpccm.container_type.SINGULARITY,
+                     raise_exceptions=True, singularity_version='3.2',
+                     userarg=userargs)
+    finally:
+        hpccm.Stage.__iadd__ = original_iadd
+        hpccm.Stage.baseimage = original_baseimage
+    if not recorded:
+        raise ValueError(f'Recipe {recipe_file} defines no layers.')
+    stages = []
+    for stage, _, _ in recorded:
+        if all(stage is not other for other in stages):
+            stages.append(stage)
+    return [Layer(lineno, type(layer).__name__, str(layer),
+                  install_prefixes(layer), installed_files(layer))
+            for stage, layer, lineno in recorded if stage is stages[-1]]
+
+
+def install_prefixes(layer):
+    '''Return the installation prefixes of a building block, i.e., the values
+    of its prefix attributes'''
+    return {value.rstrip('/') for attribute, value in vars(layer).items()
+            if (attribute == 'prefix' or attribute.endswith('__prefix'))
+            and isinstance(value, str) and value.startswith('/')}
+
+
+def cmake_files(block):
+    '''Return regular expressions for the files the cmake building block
+    installs, its prefix defaults to /usr/local, so it can't be claimed'''
+    settings = vars(block)
+    prefix = re.escape(settings.get('_cmake__prefix', '/usr/local').rstrip('/'))
+    version = '.'.join(settings.get('_cmake__version', '').split('.')[:2])
+    tools = r'(cmake|ctest|cpack|ccmake|cmake-gui)'
+    return [
+        re.compile(prefix + rf'/bin/{tools}$'),
+        re.compile(prefix + rf'/(share|doc)/cmake-{re.escape(version)}(/|$)'),
+        re.compile(prefix + r'/(man|share)/(.+/)?[^/]*(cmake|ctest|cpack)[^/]*$'),
+    ]
+
+
+# building blocks that install in a prefix that is too generic to claim, and
+# functions that return regular expressions for the files they install
+BUILDING_BLOCK_FILES = {
+    'cmake': cmake_files,
+}
+
+
+def installed_files(layer):
+    '''Return regular expressions for the files a building block installs
+    in a generic prefix, if known'''
+    rule = BUILDING_BLOCK_FILES.get(type(layer).__name__)
+    return rule(layer) if rule is not None else []
+
+
+def describe(layer, recipe_file):
+    '''Return a short description of the layer using its recipe line'''
+    if layer.lineno is None:
+        return layer.name
+    source = linecache.getline(recipe_file, layer.lineno).strip()
+    return f'line {layer.lineno}: {source}'
+
+
+def copy_destinations(layer):
+    '''Return the paths in the image a copy layer copies to'''
+    destinations = set()
+    in_files = False
+    for line in layer.text.splitlines():
+        if line.startswith('%'):
+            in_files = line.split()[0] == '%files'
+            continue
+        fields = line.split()
+        if not in_files or len(fields) < 2:
+            continue
+        *sources, dest = fields
+        for source in sources:
+            if dest.endswith('/'):
+                destinations.add(posixpath.join(dest, posixpath.basename(source.rstrip('/'))))
+            else:
+                destinations.add(dest)
+    return destinations
+
+
+def path_claims(layer):
+    '''Return the claims of a layer on paths in the image as regular
+    expressions that match the start of the paths'''
+    if layer.name == 'baseimage':
+        return []
+    if layer.name == 'copy':
+        paths = copy_destinations(layer)
+    else:
+        paths = {path.rstrip('/') or '/' for path in PATH_PATTERN.findall(layer.text)}
+        paths.update(layer.prefixes)
+    claims = [re.compile(re.escape(path) + '(/|$)')
+              for path in paths if path not in GENERIC_PATHS]
+    claims.extend(layer.installs)
+    if layer.name == 'shell':
+        for command, directory in INSTALL_COMMANDS:
+            if command.search(layer.text):
+                claims.append(directory)
+    return claims
+
+
+def apt_packages(layer):
+    '''Return the Debian packages a layer installs explicitly'''
+    text = layer.text.replace('\\\n', ' ')
+    packages = set()
+    for match in APT_INSTALL_PATTERN.findall(text):
+        for token in match.split():
+            if not token.startswith('-') and not token.endswith('.deb'):
+                packages.add(token.split('=')[0])
+    return packages
+
+
+@contextlib.contextmanager
+def sandbox(image):
+    '''Yield a sandbox directory with the contents of the image, a temporary
+    one unless the image is a sandbox directory already'''
+    if os.path.isdir(image):
+        yield image
+        return
+    with tempfile.TemporaryDirectory(prefix='analyze_image_') as work_dir:
+        directory = os.path.join(work_dir, 'rootfs')
+        subprocess.run(['apptainer', 'build', '--sandbox', directory, image],
+                       stdout=subprocess.DEVNULL, check=True)
+        yield directory
+
+
+def list_files(image):
+    '''Return a dictionary of the regular files in a sandbox directory and
+    their size'''
+    files = {}
+    for dirpath, _, filenames in os.walk(image):
+        for filename in filenames:
+            file_path = os.path.join(dirpath, filename)
+            if os.path.isfile(file_path) and not os.path.islink(file_path):
+                path = '/' + os.path.relpath(file_path, image)
+                files[path] = os.path.getsize(file_path)
+    return files
+
+
+def read_dpkg(image):
+    '''Return the installed Debian packages in a sandbox directory as a
+    dictionary that maps package names to their files and dependencies, as
+    well as a dictionary that maps virtual package names to the packages
+    providing them'''
+    status_path = os.path.join(image, 'var/lib/dpkg/status')
+    if not os.path.isfile(status_path):
+        return {}, {}
+    with open(status_path, errors='replace') as file:
+        status = file.read()
+    lists = []
+    info_dir = os.path.join(image, 'var/lib/dpkg/info')
+    for filename in sorted(os.listdir(info_dir)):
+        if filename.endswith('.list'):
+            lists.append(f'#/var/lib/dpkg/info/{filename}')
+            with open(os.path.join(info_dir, filename), errors='replace') as file:
+                lists.append(file.read())
+    lists = '\n'.join(lists)
+    packages, providers = {}, {}
+    for paragraph in status.split('\n\n'):
+        fields = dict(re.findall(r'^([\w-]+): ?(.*)$', paragraph, re.MULTILINE))
+        if 'Package' not in fields or 'installed' not in fields.get('Status', ''):
+            continue
+        dependencies = set()
+        for key in ('Depends', 'Pre-Depends'):
+            for alternatives in fields.get(key, '').split(','):
+                names = [re.split(r'[\s(:]', name.strip())[0]
+                         for name in alternatives.split('|') if name.strip()]
+                dependencies.update(names)
+        packages[fields['Package']] = {'files': set(), 'depends': dependencies}
+        for provided in fields.get('Provides', '').split(','):
+            if provided.strip():
+                name = re.split(r'[\s(:]', provided.strip())[0]
+                providers.setdefault(name, set()).add(fields['Package'])
+    package = None
+    for line in lists.splitlines():
+        if line.startswith('#'):
+            package = posixpath.basename(line[1:])[:-len('.list')].split(':')[0]
+        elif package in packages and line:
+            packages[package]['files'].add(line)
+    return packages, providers
+
+
+def attribute_packages(layers, packages, providers, base_packages):
+    '''Assign each installed package to the first layer that installs it,
+    either explicitly or as a dependency'''
+    owner = {}
+    for index, layer in enumerate(layers):
+        todo = list(apt_packages(layer))
+        while todo:
+            name = todo.pop()
+            candidates = [name] if name in packages else sorted(providers.get(name, []))
+            for candidate in candidates:
+                if candidate in owner or candidate in base_packages:
+                    continue
+                owner[candidate] = index
+                todo.extend(packages[candidate]['depends'])
+    return owner
+
+
+def attribute_files(files, layers, packages, package_owner, base_files):
+    '''Return a dictionary that maps each file to the index of its layer, to
+    BASE_IMAGE for files in the base image, or to None when it is not claimed
+    by any layer and the files of the base image are known'''
+    file_package = {}
+    for name, package in packages.items():
+        for path in package['files']:
+            file_package[path] = name
+    claims = [(claim, index) for index, layer in enumerate(layers)
+              for claim in path_claims(layer)]
+    unclaimed = None if base_files else BASE_IMAGE
+    attribution = {}
+    for path in files:
+        if path in base_files:
+            attribution[path] = BASE_IMAGE
+        elif file_package.get(path) in package_owner:
+            attribution[path] = package_owner[file_package[path]]
+        else:
+            # the longest match wins, for equal lengths the earliest layer
+            attribution[path], longest = unclaimed, 0
+            for claim, index in claims:
+                match = claim.match(path)
+                if match and match.end() > longest:
+                    attribution[path], longest = index, match.end()
+    return attribution
+
+
+def categorize(path, copied):
+    '''Return the category of a file that is likely not needed at runtime,
+    or None, copied are the paths the recipe copies into the image'''
+    name = posixpath.basename(path)
+    directory = posixpath.dirname(path)
+    is_copied = any(path == dest or path.startswith(dest + '/') for dest in copied)
+    if name.endswith(INSTALLER_SUFFIXES) and (directory in INSTALLER_DIRS or is_copied):
+        return 'installers'
+    if path.startswith(('/tmp/', '/var/tmp/')):
+        return 'temporary files'
+    components = path.split('/')
+    if path.startswith(CACHE_PREFIXES) or any(
+            component == 'pkgs' and 'conda' in parent
+            for parent, component in zip(components, components[1:])):
+        return 'package caches'
+    if path.startswith(DOC_PREFIXES) or (path.startswith(('/opt/', '/usr/local/'))
+                                         and DOC_COMPONENTS.intersection(components[:-1])):
+        return 'documentation'
+    if name.endswith('.a'):
+        return 'static libraries'
+    return None
+
+
+def format_size(size):
+    '''Format a number of bytes in human readable form'''
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if size < 1024 or unit == 'GiB':
+            return f'{size:.1f} {unit}' if unit != 'B' else f'{size} B'
+        size /= 1024
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='attribute the size of an '
+                                                     'image to recipe lines')
+    arg_parser.add_argument('--recipe', required=True,
+                            help='hpccm recipe the image was built from')
+    arg_parser.add_argument('--userarg', nargs='+', action='extend',
+                            default=[],
+                            help='user arguments for the recipe as key=value')
+    arg_parser.add_argument('--image', required=True,
+                            help='SIF image or sandbox directory')
+    arg_parser.add_argument('--base-image',
+                            help='base image, e.g., docker://ubuntu:22.04, to '
+                                 'attribute its files to the base image line')
+    arg_parser.add_argument('--network-bandwidth', type=float, default=100.0,
+                            help='MB/s to pull or stage the image to a node')
+    arg_parser.add_argument('--stage-bandwidth', type=float, default=500.0,
+                            help='MB/s to copy the image to node-local storage at startup')
+    arg_parser.add_argument('--top', type=int, default=3,
+                            help='number of largest files to show per flagged category')
+    options = arg_parser.parse_args()
+
+    layers = load_layers(options.recipe, parse_userargs(options.userarg))
+    with sandbox(options.image) as directory:
+        files = list_files(directory)
+        packages, providers = read_dpkg(directory)
+    base_files, base_packages = set(), set()
+    if options.base_image:
+        with sandbox(options.base_image) as directory:
+            base_files = set(list_files(directory))
+            base_packages = set(read_dpkg(directory)[0])
+    package_owner = attribute_packages(layers, packages, providers, base_packages)
+    attribution = attribute_files(files, layers, packages, package_owner,
+                                  base_files)
+
+    # the SIF file is compressed, so estimate the compression ratio to
+    # translate sizes into bytes to transfer
+    total_size = sum(files.values())
+    ratio = 1.0
+    if os.path.isfile(options.image) and total_size > 0:
+        ratio = os.path.getsize(options.image)/total_size
+
+    copied = set()
+    for layer in layers:
+        if layer.name == 'copy':
+            copied.update(copy_destinations(layer))
+
+    layer_sizes = collections.Counter()
+    layer_counts = collections.Counter()
+    flagged = collections.defaultdict(list)
+    for path, size in files.items():
+        index = attribution[path]
+        layer_sizes[index] += size
+        layer_counts[index] += 1
+        category = categorize(path, copied)
+        if category is not None:
+            flagged[(index, category)].append((size, path))
+
+    base_layers = [layer for layer in layers if layer.name == 'baseimage']
+
+    def label(index):
+        if index is None:
+            return 'not attributed'
+        if index == BASE_IMAGE:
+            base = describe(base_layers[0], options.recipe) if base_layers else BASE_IMAGE
+            return base if base_files else f'{base} or not attributed'
+        return describe(layers[index], options.recipe)
+
+    print(f'{len(files)} files, {format_size(total_size)}, '
+          f'compression ratio {ratio:.2f}')
+    print('\nSize per recipe line:')
+    for index, size in layer_sizes.most_common():
+        print(f'{format_size(size):>12} {layer_counts[index]:>8} files  {label(index)}')
+
+    print('\nFiles likely not needed at runtime:')
+    total_saved = 0
+    for (index, category), entries in sorted(flagged.items(),
+                                             key=lambda item: -sum(size for size, _ in item[1])):
+        size = sum(size for size, _ in entries)
+        total_saved += size
+        megabytes = size*ratio/1e6
+        print(f'{format_size(size):>12} {len(entries):>8} {category:<17}  {label(index)}')
+        print(f'{"":>22} saves ~{megabytes/options.network_bandwidth:.1f} s transfer, '
+              f'~{megabytes/options.stage_bandwidth:.1f} s staging per node')
+        for file_size, path in sorted(entries, reverse=True)[:options.top]:
+            print(f'{"":>22} {format_size(file_size):>12}  {path}')
+    megabytes = total_saved*ratio/1e6
+    print(f'\nTotal: {format_size(total_saved)}, ~{megabytes/options.network_bandwidth:.1f} s '
+          f'transfer, ~{megabytes/options.stage_bandwidth:.1f} s staging per node')
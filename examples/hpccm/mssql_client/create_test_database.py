@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+'''Create a SQLite database with a table of random orders that can stand in
+for an SQL Server database when trying `extract_table.py`, either directly
+using the sqlite3 module, or via ODBC using the SQLite ODBC driver.
+
+Usage:
+    $ ./create_test_database.py  --rows 1000000  test.db
+'''
+
+import argparse
+import datetime
+import random
+import sqlite3
+
+
+def generate_orders(nr_rows, batch_size=10_000):
+    '''Generate batches of rows for the orders table'''
+    start = datetime.datetime(2020, 1, 1)
+    batch = []
+    for order_id in range(1, nr_rows + 1):
+        batch.append((
+            order_id,
+            random.randint(1, 10_000),
+            random.choice(['book', 'pen', 'paper', 'ink', None]),
+            random.randint(1, 100),
+            round(random.uniform(0.5, 500.0), 2),
+            (start + datetime.timedelta(minutes=order_id)).isoformat(sep=' '),
+        ))
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='create a test database')
+    arg_parser.add_argument('database', help='SQLite database file to create')
+    arg_parser.add_argument('--rows', type=int, default=100_000,
+                            help='number of rows in the orders table')
+    options = arg_parser.parse_args()
+    with sqlite3.connect(options.database) as connection:
+        connection.execute('DROP TABLE IF EXISTS orders')
+        connection.execute('''CREATE TABLE orders (
+                                  order_id INTEGER PRIMARY KEY,
+                                  customer_id INTEGER NOT NULL,
+                                  product TEXT,
+                                  quantity INTEGER NOT NULL,
+                                  price REAL NOT NULL,
+                                  ordered_at TEXT NOT NULL
+                              )''')
+        for batch in generate_orders(options.rows):
+            connection.executemany('INSERT INTO orders VALUES (?, ?, ?, ?, ?, ?)',
+                                   batch)
+    connection.close()
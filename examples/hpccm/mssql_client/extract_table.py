@@ -0,0 +1,340 @@
+#!/usr/bin/env python
+'''Extract the result of a query from a database into Parquet or Arrow files.
+
+Rows are fetched in large batches and written to the output file batch by
+batch, so the result set never has to fit in memory.  Optionally, the query
+is split into partitions on a numeric column that are extracted in parallel,
+each into its own file, using a pool of connections.
+
+Usage:
+    $ ./extract_table.py  \
+          --connection 'DRIVER={ODBC Driver 17 for SQL Server};SERVER=db;DATABASE=sales;UID=user;PWD=secret'  \
+          --query 'SELECT * FROM orders'  --output orders.parquet
+    $ ./extract_table.py  --connection ...  --query 'SELECT * FROM orders'  \
+          --partition-column order_id  --partitions 16  --workers 4  \
+          --output orders/
+
+The connection is made using pyodbc by default, use `--module pymssql` for
+FreeTDS via pymssql, or `--module sqlite3` for a local SQLite database.
+'''
+
+import argparse
+import concurrent.futures
+import contextlib
+import datetime
+import decimal
+import importlib
+import pathlib
+import threading
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+# Arrow types for the Python types pyodbc reports in cursor.description
+ARROW_TYPES = {
+    bool: pa.bool_(),
+    int: pa.int64(),
+    float: pa.float64(),
+    str: pa.string(),
+    bytes: pa.binary(),
+    bytearray: pa.binary(),
+    datetime.datetime: pa.timestamp('us'),
+    datetime.date: pa.date32(),
+    datetime.time: pa.time64('us'),
+}
+
+# pymssql.connect arguments for the keys of an ODBC connection string, keys
+# that are not listed are passed on as is, DRIVER only applies to ODBC
+PYMSSQL_ARGUMENTS = {
+    'server': 'server',
+    'uid': 'user',
+    'pwd': 'password',
+    'database': 'database',
+    'port': 'port',
+    'driver': None,
+}
+
+FILE_EXTENSIONS = {
+    'parquet': '.parquet',
+    'arrow': '.arrow',
+}
+
+
+class ConnectionPool:
+    '''Pool of database connections that are created on demand, up to a
+    maximum number, and reused afterwards'''
+
+    def __init__(self, connect, size):
+        self._connect = connect
+        self._size = size
+        self._nr_connections = 0
+        self._idle = []
+        self._condition = threading.Condition()
+
+    @contextlib.contextmanager
+    def connection(self):
+        '''Context manager that hands out a connection and returns it to the
+        pool afterwards; when the body raises an exception, the connection
+        may be in an unknown state, so it is closed rather than reused'''
+        connection = self._acquire()
+        try:
+            yield connection
+        except BaseException:
+            self._discard(connection)
+            raise
+        with self._condition:
+            self._idle.append(connection)
+            self._condition.notify()
+
+    def _acquire(self):
+        with self._condition:
+            while not self._idle and self._nr_connections >= self._size:
+                self._condition.wait()
+            if self._idle:
+                return self._idle.pop()
+            self._nr_connections += 1
+        try:
+            return self._connect()
+        except BaseException:
+            self._forget()
+            raise
+
+    def _discard(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+        self._forget()
+
+    def _forget(self):
+        with self._condition:
+            self._nr_connections -= 1
+            self._condition.notify()
+
+    def close(self):
+        '''Close all idle connections'''
+        with self._condition:
+            idle, self._idle = self._idle, []
+            self._nr_connections -= len(idle)
+        for connection in idle:
+            connection.close()
+
+
+def parse_connection_string(connection_string):
+    '''Convert an ODBC connection string of key=value pairs separated by
+    semicolons into a dictionary of pymssql.connect arguments'''
+    parameters = {}
+    for item in connection_string.split(';'):
+        if item.strip():
+            key, sep, value = item.partition('=')
+            key = key.strip().lower()
+            if not sep or not key:
+                raise ValueError(f'Connection string item "{item}" should be '
+                                 f'of the form key=value.')
+            argument = PYMSSQL_ARGUMENTS.get(key, key)
+            if argument is not None:
+                parameters[argument] = value.strip().removeprefix('{').removesuffix('}')
+    # ODBC specifies the port as SERVER=host,port
+    server, sep, port = parameters.get('server', '').partition(',')
+    if sep:
+        parameters['server'], parameters['port'] = server.strip(), port.strip()
+    return parameters
+
+
+def create_connector(module_name, connection_string):
+    '''Return a function without arguments that opens a new connection'''
+    module = importlib.import_module(module_name)
+    if module_name == 'pyodbc':
+        return lambda: module.connect(connection_string, autocommit=True)
+    if module_name == 'pymssql':
+        parameters = parse_connection_string(connection_string)
+        return lambda: module.connect(**parameters)
+    if module_name == 'sqlite3':
+        return lambda: module.connect(connection_string, check_same_thread=False)
+    raise ValueError(f'Unsupported database module {module_name}.')
+
+
+def describe_schema(description):
+    '''Determine the Arrow schema from the cursor description, columns whose
+    type is not reported have the null type'''
+    fields = []
+    for column in description:
+        name, type_code = column[0], column[1]
+        if type_code is decimal.Decimal and column[4] is not None:
+            arrow_type = pa.decimal128(column[4], column[5] or 0)
+        elif type_code in ARROW_TYPES:
+            arrow_type = ARROW_TYPES[type_code]
+        else:
+            arrow_type = pa.null()
+        fields.append(pa.field(name, arrow_type))
+    return pa.schema(fields)
+
+
+def infer_schema(description, rows):
+    '''Determine the Arrow schema from the cursor description, and the types
+    that are not reported, e.g., by sqlite3 or pymssql, from the first batch
+    of rows; columns without values in that batch are stored as text'''
+    schema = describe_schema(description)
+    columns = list(zip(*rows)) if rows else [[] for _ in schema]
+    fields = []
+    for field, column in zip(schema, columns):
+        arrow_type = field.type
+        if pa.types.is_null(arrow_type):
+            try:
+                arrow_type = pa.array(list(column)).type
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                arrow_type = pa.string()
+            if pa.types.is_null(arrow_type):
+                arrow_type = pa.string()
+        fields.append(pa.field(field.name, arrow_type))
+    return pa.schema(fields)
+
+
+def to_array(values, field):
+    '''Convert a column of values into an Arrow array of the field's type,
+    the values are converted as is and then cast, since converting directly
+    silently truncates floating point values in integer columns'''
+    try:
+        return pa.array(values).cast(field.type)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError) as error:
+        if not pa.types.is_string(field.type):
+            raise ValueError(f'Column {field.name} has values that are not '
+                             f'{field.type}, use CAST in the query: {error}') from error
+        # values of mixed types are stored as text
+        return pa.array([None if value is None else str(value) for value in values],
+                        type=pa.string())
+
+
+def to_table(rows, schema):
+    '''Convert a batch of rows into an Arrow table with the given schema'''
+    columns = zip(*rows) if rows else [[] for _ in schema]
+    arrays = [to_array(list(column), field)
+              for column, field in zip(columns, schema)]
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def open_writer(path, schema, file_format):
+    '''Open a writer for the given file format'''
+    if file_format == 'parquet':
+        return pq.ParquetWriter(path, schema, compression='zstd')
+    if file_format == 'arrow':
+        return pa.ipc.new_file(path, schema)
+    raise ValueError(f'Unsupported file format {file_format}.')
+
+
+def extract(pool, query, path, file_format, batch_size, schema, sets_schema=True):
+    '''Run the query and stream the result to a file batch by batch, and
+    return the number of rows written; schema is a future for the schema of
+    the file, when sets_schema is true, it is set from the cursor description
+    and the first batch, otherwise the extraction waits until it is set, so
+    that all partitions share the schema of the first one'''
+    nr_rows = 0
+    with pool.connection() as connection:
+        cursor = connection.cursor()
+        try:
+            cursor.arraysize = batch_size
+            try:
+                cursor.execute(query)
+                rows = cursor.fetchmany(batch_size)
+                if sets_schema:
+                    schema.set_result(infer_schema(cursor.description, rows))
+            except BaseException as error:
+                if sets_schema and not schema.done():
+                    schema.set_exception(error)
+                raise
+            writer = open_writer(path, schema.result(), file_format)
+            try:
+                while rows:
+                    writer.write_table(to_table(rows, schema.result()))
+                    nr_rows += len(rows)
+                    rows = cursor.fetchmany(batch_size)
+            finally:
+                writer.close()
+        finally:
+            cursor.close()
+    return nr_rows
+
+
+def partition_queries(pool, query, column, nr_partitions):
+    '''Split the query into queries over non-overlapping ranges of an
+    integer column, and one for the rows where the column is NULL, if any'''
+    with pool.connection() as connection:
+        cursor = connection.cursor()
+        try:
+            cursor.execute(f'SELECT MIN({column}), MAX({column}), '
+                           f'COUNT(*) - COUNT({column}) FROM ({query}) AS q')
+            lower, upper, nr_nulls = cursor.fetchone()
+        finally:
+            cursor.close()
+    queries = []
+    if lower is not None:
+        lower, upper = int(lower), int(upper)
+        step = max(1, -(-(upper - lower + 1) // nr_partitions))
+        for start in range(lower, upper + 1, step):
+            queries.append(f'SELECT * FROM ({query}) AS q '
+                           f'WHERE {column} >= {start} AND {column} < {start + step}')
+    if nr_nulls:
+        queries.append(f'SELECT * FROM ({query}) AS q WHERE {column} IS NULL')
+    return queries if queries else [query]
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='extract a query result '
+                                                     'into Parquet or Arrow files')
+    arg_parser.add_argument('--connection', required=True,
+                            help='connection string, or file name for sqlite3')
+    arg_parser.add_argument('--module', choices=['pyodbc', 'pymssql', 'sqlite3'],
+                            default='pyodbc', help='database module to connect with')
+    arg_parser.add_argument('--query', required=True, help='query to extract')
+    arg_parser.add_argument('--output', required=True,
+                            help='output file, or directory when partitioned')
+    arg_parser.add_argument('--format', choices=FILE_EXTENSIONS.keys(),
+                            default='parquet', help='output file format')
+    arg_parser.add_argument('--batch-size', type=int, default=50_000,
+                            help='number of rows to fetch per batch')
+    arg_parser.add_argument('--partition-column',
+                            help='integer column to partition the query on')
+    arg_parser.add_argument('--partitions', type=int, default=1,
+                            help='number of partitions')
+    arg_parser.add_argument('--workers', type=int, default=1,
+                            help='number of partitions to extract concurrently')
+    options = arg_parser.parse_args()
+
+    if options.batch_size < 1:
+        raise ValueError('The batch size should be positive.')
+    if options.workers < 1:
+        raise ValueError('The number of workers should be positive.')
+    if options.partitions < 1:
+        raise ValueError('The number of partitions should be positive.')
+    if options.partitions > 1 and options.partition_column is None:
+        raise ValueError('Partitioning requires --partition-column.')
+    pool = ConnectionPool(create_connector(options.module, options.connection),
+                          size=options.workers)
+    try:
+        if options.partition_column is None:
+            nr_rows = extract(pool, options.query, options.output,
+                              options.format, options.batch_size,
+                              concurrent.futures.Future())
+            print(f'{nr_rows} rows written to {options.output}')
+        else:
+            queries = partition_queries(pool, options.query,
+                                        options.partition_column,
+                                        options.partitions)
+            output_dir = pathlib.Path(options.output)
+            output_dir.mkdir(parents=True, exist_ok=True)
+            extension = FILE_EXTENSIONS[options.format]
+            paths = [output_dir / f'part-{index:05d}{extension}'
+                     for index in range(len(queries))]
+            # the first partition is submitted first, so it runs while the
+            # others wait for its schema
+            schema = concurrent.futures.Future()
+            with concurrent.futures.ThreadPoolExecutor(options.workers) as executor:
+                futures = [executor.submit(extract, pool, query, path,
+                                           options.format, options.batch_size,
+                                           schema, index == 0)
+                           for index, (query, path) in enumerate(zip(queries, paths))]
+                total_rows = sum(future.result() for future in futures)
+            print(f'{total_rows} rows written to {len(queries)} files in {output_dir}')
+    finally:
+        pool.close()
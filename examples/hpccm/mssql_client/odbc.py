@@ -33,9 +33,18 @@ Stage0 += apt_get(ospackages=['unixodbc',  'unixodbc-dev',  'libodbc1',
                               'odbcinst1debian2', 'tdsodbc'])
 Stage0 += apt_get(ospackages=['freetds-bin', 'freetds-common', 'freetds-dev', ])
 
+# install the SQLite ODBC driver to test against a local stand-in database
+Stage0 += apt_get(ospackages=['sqlite3', 'libsqliteodbc'])
+
 # copy the conda environment into the container
 # Stage0 += copy(src=['environment.yml'],
 #                dest='/var/tmp')
 
 # install the environment
-Stage0 += conda(packages=['pyodbc', 'pymssql', 'xlrd=1.2.0'], eula=True)
+Stage0 += conda(packages=['pyodbc', 'pymssql', 'xlrd=1.2.0', 'pyarrow'], eula=True)
+Stage0 += environment(variables={'PATH': '/usr/local/anaconda/bin:$PATH'})
+
+# install the extraction client and the script to create a test database
+Stage0 += copy(src=['extract_table.py', 'create_test_database.py'],
+               dest='/usr/local/bin/')
+Stage0 += shell(commands=['chmod 755 /usr/local/bin/extract_table.py /usr/local/bin/create_test_database.py'])
@@ -50,6 +50,9 @@ if bootstrap == 'localimage':
 # Choose a base image
 Stage0 += baseimage(image=image, _bootstrap=bootstrap)
  
+# Set permissions of /tmp
+Stage0 += shell(commands=['chmod 1777 /tmp'])
+
 # Install apt packages
 if apt_packages:
     Stage0 += apt_get(ospackages=apt_packages)
@@ -57,7 +60,7 @@ if apt_packages:
 # Add CRAN repository and signature key
 if bootstrap == 'docker':
     Stage0 += shell(commands=['wget -qO- https://cloud.r-project.org/bin/linux/ubuntu/marutter_pubkey.asc | tee -a /etc/apt/trusted.gpg.d/cran_ubuntu_key.asc'])
-    Stage0 += shell(commands=['add-apt-repository \'deb https://cloud.r-project.org/bin/linux/ubuntu $(lsb_release -cs)-cran40/\''])
+    Stage0 += shell(commands=['add-apt-repository "deb https://cloud.r-project.org/bin/linux/ubuntu $(lsb_release -cs)-cran40/"'])
     Stage0 += shell(commands=['apt-key adv --keyserver keyserver.ubuntu.com --recv-keys 51716619E084DAB9'])
 
 # Install CMake and compiler suite
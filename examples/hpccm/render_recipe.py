@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+'''Render an hpccm recipe to a Dockerfile or a Singularity/Apptainer
+definition file, using hpccm as a library rather than the `hpccm`
+command line tool.
+
+The output file is only regenerated when the recipe, the output format,
+the user arguments (including the contents of files passed as user
+arguments) or the hpccm version change.  A digest of these inputs is
+stored next to the output file.
+
+Usage:
+    $ ./render_recipe.py  --recipe simple.py  --format docker  \
+                          --output Dockerfile
+    $ ./render_recipe.py  --recipe r_container/r_container.py  \
+                          --format singularity  \
+                          --userarg apt_list=apt_packages.txt  \
+                                    r_package_install=install_packages.R  \
+                          --output r_container.recipe
+
+Note that hpccm has to be installed in the Python environment that runs
+this script, e.g., using the `environment.yml` file at the top of the
+repository.
+'''
+
+import argparse
+import hashlib
+import pathlib
+import sys
+
+import hpccm
+
+
+FORMATS = {
+    'docker': hpccm.container_type.DOCKER,
+    'singularity': hpccm.container_type.SINGULARITY,
+}
+
+# files larger than this are identified by their size and modification time
+# rather than their contents, e.g., a local base image
+MAX_HASHED_SIZE = 64*1024**2
+
+
+def parse_userargs(userargs):
+    '''Convert a list of key=value strings into a dictionary'''
+    result = {}
+    for userarg in userargs:
+        key, sep, value = userarg.partition('=')
+        if not sep or not key:
+            raise ValueError(f'User argument "{userarg}" should be of the form key=value.')
+        result[key] = value
+    return result
+
+
+def update_with_file(digest, path):
+    '''Update the digest with the contents of a file, or with its size and
+    modification time for large files'''
+    stat = path.stat()
+    if stat.st_size > MAX_HASHED_SIZE:
+        digest.update(f'size={stat.st_size} mtime={stat.st_mtime_ns}\n'.encode())
+        return
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024**2), b''):
+            digest.update(chunk)
+
+
+def compute_digest(recipe_file, fmt, singularity_version, userargs):
+    '''Compute a digest of everything that determines the rendered recipe'''
+    digest = hashlib.sha256()
+    digest.update(f'hpccm={hpccm.__version__}\n'.encode())
+    digest.update(f'format={fmt}\n'.encode())
+    digest.update(f'singularity_version={singularity_version}\n'.encode())
+    digest.update(pathlib.Path(recipe_file).read_bytes())
+    for key, value in sorted(userargs.items()):
+        digest.update(f'userarg {key}={value}\n'.encode())
+        # user arguments that refer to files are inputs as well
+        if pathlib.Path(value).is_file():
+            update_with_file(digest, pathlib.Path(value))
+    return digest.hexdigest()
+
+
+def digest_path(output_file):
+    '''Return the path of the file that stores the digest for an output file'''
+    output_path = pathlib.Path(output_file)
+    return output_path.with_name(f'.{output_path.name}.digest')
+
+
+def is_up_to_date(output_file, digest):
+    '''Check whether the output file exists and was rendered from the same inputs'''
+    stamp = digest_path(output_file)
+    if not pathlib.Path(output_file).is_file() or not stamp.is_file():
+        return False
+    return stamp.read_text().strip() == digest
+
+
+def render(recipe_file, fmt, singularity_version, userargs):
+    '''Render the recipe in-process and return the specification as a string'''
+    return hpccm.recipe(recipe_file, ctype=FORMATS[fmt],
+                        raise_exceptions=True,
+                        singularity_version=singularity_version,
+                        userarg=userargs)
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='render an hpccm recipe')
+    arg_parser.add_argument('--recipe', required=True,
+                            help='hpccm recipe file to render')
+    arg_parser.add_argument('--format', choices=FORMATS.keys(),
+                            default='singularity',
+                            help='container specification format')
+    arg_parser.add_argument('--singularity-version', default='2.6',
+                            help='Singularity definition file format version, '
+                                 'use 3.2 or later for multi-stage recipes')
+    arg_parser.add_argument('--userarg', nargs='+', action='extend',
+                            default=[],
+                            help='user arguments for the recipe as key=value')
+    arg_parser.add_argument('--output',
+                            help='file to write the specification to, '
+                                 'standard output if not specified')
+    arg_parser.add_argument('--force', action='store_true',
+                            help='render even if the output is up to date')
+    options = arg_parser.parse_args()
+
+    if not pathlib.Path(options.recipe).is_file():
+        raise FileNotFoundError(f'Recipe file {options.recipe} not found.')
+    userargs = parse_userargs(options.userarg)
+
+    if options.output is None:
+        print(render(options.recipe, options.format,
+                     options.singularity_version, userargs))
+        sys.exit(0)
+
+    digest = compute_digest(options.recipe, options.format,
+                            options.singularity_version, userargs)
+    if not options.force and is_up_to_date(options.output, digest):
+        print(f'{options.output} is up to date', file=sys.stderr)
+        sys.exit(0)
+    specification = render(options.recipe, options.format,
+                           options.singularity_version, userargs)
+    pathlib.Path(options.output).write_text(specification + '\n')
+    digest_path(options.output).write_text(digest + '\n')
+    print(f'{options.output} rendered', file=sys.stderr)
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+'''Evict files from the operating system's page cache so that the next
+access has to read them from storage again.
+
+This does not require root privileges, it uses posix_fadvise on each file,
+which is honored for files that have no pending writes.  Directories are
+processed recursively, which is useful for sandbox images.
+
+Usage:
+    $ ./evict_page_cache.py image.sif
+    $ ./evict_page_cache.py sandbox_dir/
+'''
+
+import argparse
+import os
+import pathlib
+
+
+def evict_file(path):
+    '''Evict a single file from the page cache, return True on success'''
+    try:
+        fd = os.open(path, os.O_RDONLY | os.O_NOFOLLOW)
+    except OSError:
+        return False
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+    return True
+
+
+def evict(path):
+    '''Evict a file, or all files in a directory tree, return the number of
+    files that were evicted'''
+    path = pathlib.Path(path)
+    if not path.is_dir():
+        return int(evict_file(path))
+    nr_files = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            file_path = os.path.join(dirpath, filename)
+            if not os.path.islink(file_path):
+                nr_files += evict_file(file_path)
+    return nr_files
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='evict files from the page cache')
+    arg_parser.add_argument('paths', nargs='+',
+                            help='files or directories to evict')
+    arg_parser.add_argument('--verbose', action='store_true',
+                            help='report the number of evicted files')
+    options = arg_parser.parse_args()
+    for path in options.paths:
+        nr_files = evict(path)
+        if options.verbose:
+            print(f'{path}: {nr_files} files evicted')